@@ -2,12 +2,35 @@ import os
 import numpy as np
 import librosa
 import soundfile as sf
-import re
 from glob import glob
-import math
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+# SIMD 기반 단일 패스 RMS 구현 (없으면 NumPy로 대체)
+try:
+    import numpy_rms
+except ImportError:
+    numpy_rms = None
+
+# 합성/정규화 커널 JIT 컴파일용 (없으면 NumPy로 대체)
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# librosa.resample의 디스패치 없이 soxr를 직접 호출 (없으면 librosa로 대체)
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+# 물리 코어 수 조회용 (없으면 논리 코어 기준으로 대체)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 # 폴더 경로 설정
 target_dir = 'SER_IS2025'
 noise_dir = 'noise_audio'
@@ -19,28 +42,121 @@ snr_levels = {
     'hard': -1     # 소음이 큰 환경 (음성과 소음이 같은 크기)
 }
 
+# SNR(dB)을 선형 전력비로 미리 변환 (작업마다 10**(snr/10)을 재계산하지 않음)
+SNR_LINEAR = np.array([10 ** (v / 10) for v in snr_levels.values()], dtype=np.float32)
+
+# 한 작업에서 함께 처리할 타겟 파일 수 (길이순 정렬 후 묶으므로 패딩 낭비가 적음)
+BATCH_SIZE = 8
+
+# wav 파일 로드 함수 (librosa 대신 soundfile 직접 사용)
+def load_wav(filepath):
+    """wav 파일을 float32로 읽어 (신호, 샘플링 레이트)를 반환합니다."""
+    data, sr = sf.read(filepath, dtype='float32', always_2d=False)
+    # 다채널이면 모노로 평균
+    if data.ndim > 1:
+        data = data.mean(axis=1, dtype=np.float32)
+    return data, sr
+
 # 소리의 크기(RMS power) 계산 함수
 def calculate_rms(audio):
     """오디오 신호의 RMS(Root Mean Square) 값을 계산합니다."""
+    if numpy_rms is not None:
+        # 제곱 임시 배열 없이 한 번의 메모리 패스로 계산
+        # numpy_rms.rms는 (1,) 배열을 반환하므로 원소를 꺼내 스칼라로 변환
+        return float(numpy_rms.rms(np.ascontiguousarray(audio, dtype=np.float32))[0])
     return np.sqrt(np.mean(np.square(audio)))
 
-# 원하는 SNR로 소음 조절 함수
-def adjust_noise_to_snr(speech, noise, target_snr):
-    """목표 SNR에 맞게 소음 레벨을 조정합니다."""
-    speech_rms = calculate_rms(speech)
-    noise_rms = calculate_rms(noise)
-    
+# 원하는 SNR들에 대한 소음 조정 계수 계산 함수
+def snr_adjustment_factors(speech_rms, noise_rms):
+    """SNR_LINEAR의 각 레벨에 대한 소음 조정 계수를 한 번에 계산합니다."""
     # SNR = 10 * log10(speech_power / noise_power)
     # noise_power = speech_power / (10^(SNR/10))
-    target_noise_rms = speech_rms / (10 ** (target_snr / 10))
-    
-    # 조정 계수 계산
-    adjustment_factor = target_noise_rms / noise_rms
-    
-    # 소음 조정
-    adjusted_noise = noise * adjustment_factor
-    
-    return adjusted_noise
+    # RMS 스칼라가 float64여도 결과가 float32를 유지하도록 캐스팅
+    return np.asarray((speech_rms / noise_rms) / SNR_LINEAR, dtype=np.float32)
+
+if njit is not None:
+    # max(abs(x))를 abs 임시 배열 없이 한 번의 패스로 계산하는 리덕션
+    @njit(fastmath=True, cache=True)
+    def absmax(audio):
+        peak = 0.0
+        for i in range(audio.size):
+            v = audio[i] if audio[i] >= 0 else -audio[i]
+            if v > peak:
+                peak = v
+        return peak
+else:
+    def absmax(audio):
+        """신호의 최대 절댓값(피크)을 반환합니다."""
+        return np.max(np.abs(audio))
+
+if njit is not None:
+    # 합성 + 피크 탐색 + 정규화를 한 번의 메모리 패스로 융합한 커널
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mix_and_normalize(speech, noise, factors, out, may_clip):
+        for r in prange(factors.size):
+            f = factors[r]
+            if may_clip:
+                peak = 0.0
+                for i in range(speech.size):
+                    v = speech[i] + f * noise[i]
+                    out[r, i] = v
+                    av = abs(v)
+                    if av > peak:
+                        peak = av
+                if peak > 1.0:
+                    inv = 1.0 / peak
+                    for i in range(speech.size):
+                        out[r, i] *= inv
+            else:
+                for i in range(speech.size):
+                    out[r, i] = speech[i] + f * noise[i]
+
+# 음성/소음 합성 및 클리핑 방지 정규화 함수
+def mix_and_normalize(speech, noise, factors, may_clip=True, out=None):
+    """각 조정 계수별로 음성과 소음을 합성하고 클리핑을 방지해 (3, N)을 반환합니다.
+
+    may_clip이 False면 (피크 상한 분석으로 클리핑이 불가능하다고 판정된 경우)
+    피크 탐색과 정규화를 건너뜁니다. out으로 재사용 버퍼를 받을 수 있습니다.
+    """
+    factors = factors.astype(np.float32, copy=False)
+    if out is None:
+        out = np.empty((factors.size, speech.size), dtype=np.float32)
+    if njit is not None:
+        _mix_and_normalize(speech, noise, factors, out, may_clip)
+        return out
+    np.multiply(noise[None, :], factors[:, None], out=out)
+    out += speech[None, :]
+    if may_clip:
+        for row in range(out.shape[0]):
+            peak = absmax(out[row])
+            if peak > 1.0:
+                out[row] /= peak
+    return out
+
+# wav 파일 저장 함수 (버퍼 단위 일괄 기록)
+def write_wav(filepath, samples, sr):
+    """int16 샘플을 한 번의 buffer_write로 기록해 쓰기 호출 횟수를 줄입니다."""
+    with sf.SoundFile(filepath, 'w', samplerate=sr, channels=1,
+                      format='WAV', subtype='PCM_16') as f:
+        f.buffer_write(samples.tobytes(), dtype='int16')
+
+# 소음을 음성 길이에 맞추는 함수 (반복 또는 자르기)
+def fit_noise_length(noise, length, out=None):
+    """소음을 목표 길이에 맞춰 자르거나, 초과 복사 없이 반복해서 채웁니다."""
+    n = len(noise)
+    if n >= length:
+        return noise[:length]
+    # np.tile은 올림한 반복 횟수만큼 전부 복사한 뒤 잘라내므로,
+    # 목적지 버퍼에 필요한 만큼만 한 번씩 써넣는다
+    if out is None:
+        out = np.empty(length, dtype=noise.dtype)
+    else:
+        out = out[:length]
+    full, remainder = divmod(length, n)
+    for k in range(full):
+        out[k * n:(k + 1) * n] = noise
+    out[full * n:] = noise[:remainder]
+    return out
 
 # 파일명에서 .wav 확장자만 제거하는 함수
 def get_filename_without_extension(filepath):
@@ -49,63 +165,187 @@ def get_filename_without_extension(filepath):
     name_without_ext = os.path.splitext(base_name)[0]
     return name_without_ext
 
-# 단일 작업 처리 함수 (병렬 처리용)
-def process_combination(args):
-    target_file, noise_file, level_name, snr_value, idx = args
-    
+# 리샘플링 결과 캐시 함수 ((노이즈 파일, 목표 sr)별로 한 번만 계산)
+def resample_noise(noise_file, noise, noise_sr, target_sr):
+    """소음을 목표 샘플링 레이트로 변환하고 워커별 캐시에 보관합니다."""
+    key = (noise_file, target_sr)
+    cached = _RESAMPLED_CACHE.get(key)
+    if cached is None:
+        if soxr is not None:
+            cached = soxr.resample(noise, noise_sr, target_sr, quality='HQ')
+        else:
+            cached = librosa.resample(noise, orig_sr=noise_sr, target_sr=target_sr)
+        # 이후 연산이 전부 float32로 돌도록 업캐스팅 차단
+        cached = np.asarray(cached, dtype=np.float32)
+        _RESAMPLED_CACHE[key] = cached
+    return cached
+
+# 워커 프로세스에서 공유하는 노이즈 캐시 (fork 시 부모로부터 상속됨)
+_NOISE_CACHE = {}
+
+# 워커별 리샘플링 결과 캐시
+_RESAMPLED_CACHE = {}
+
+# 워커별 노이즈 피크 캐시 ((노이즈 파일, sr) 기준)
+_NOISE_PEAK_CACHE = {}
+
+# 워커별 재사용 스크래치 버퍼 (본 것 중 가장 긴 음성 기준으로 필요 시 확장)
+_MIX_SCRATCH = np.empty(0, dtype=np.float32)
+_NOISE_SCRATCH = np.empty(0, dtype=np.float32)
+
+def _mix_buffer(rows, length):
+    """(rows, length) 크기의 합성용 스크래치 뷰를 반환합니다."""
+    global _MIX_SCRATCH
+    needed = rows * length
+    if _MIX_SCRATCH.size < needed:
+        _MIX_SCRATCH = np.empty(needed, dtype=np.float32)
+    return _MIX_SCRATCH[:needed].reshape(rows, length)
+
+def _noise_buffer(length):
+    """소음 반복 채우기용 스크래치 뷰를 반환합니다."""
+    global _NOISE_SCRATCH
+    if _NOISE_SCRATCH.size < length:
+        _NOISE_SCRATCH = np.empty(length, dtype=np.float32)
+    return _NOISE_SCRATCH[:length]
+
+# 워커 프로세스 수 결정 함수
+def default_worker_count():
+    """병렬 처리에 쓸 워커 수를 반환합니다.
+
+    메모리 바운드 FP 연산은 SMT 형제 코어가 같은 캐시를 두고 경쟁하므로
+    논리 코어가 아닌 물리 코어 수를 기준으로 합니다.
+    """
+    if psutil is not None:
+        physical = psutil.cpu_count(logical=False)
+        if physical:
+            return physical
+    # 물리 코어 수를 알 수 없으면 사용 가능한 논리 코어의 80%
     try:
-        # 음성 파일 로드
-        speech, sr = librosa.load(target_file, sr=None)
-        
-        # 노이즈 파일 로드
-        noise, noise_sr = librosa.load(noise_file, sr=None)
-        
-        # 노이즈 이름 추출 (.wav 제거)
-        noise_id = get_filename_without_extension(noise_file)
-        
-        # 샘플링 레이트가 다르면 소음 파일 리샘플링
-        if sr != noise_sr:
-            noise = librosa.resample(noise, orig_sr=noise_sr, target_sr=sr)
-        
-        # 음성 길이에 맞추어 소음 조정 (반복 또는 자르기)
-        if len(noise) < len(speech):
-            # 소음이 더 짧으면 반복
-            repetitions = math.ceil(len(speech) / len(noise))
-            noise = np.tile(noise, repetitions)
-        
-        # 음성 길이에 맞게 소음 자르기
-        noise = noise[:len(speech)]
-        
-        # 소음 조정
-        adjusted_noise = adjust_noise_to_snr(speech, noise, snr_value)
-        
-        # 음성과 소음 합성
-        mixed_audio = speech + adjusted_noise
-        
-        # 클리핑 방지를 위한 정규화
-        max_abs_value = np.max(np.abs(mixed_audio))
-        if max_abs_value > 1.0:
-            mixed_audio = mixed_audio / max_abs_value
-        
-        # 타겟 파일명 추출
-        target_basename = get_filename_without_extension(target_file)
-        
-        # 출력 폴더명 설정 ({난이도}_{노이즈명} 형식)
-        output_dir = f"{level_name}_{noise_id}"
-        
-        # 출력 폴더가 없으면 생성
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 출력 파일 이름 (원본 파일명 유지)
-        output_filename = f"{target_basename}.wav"
-        output_path = os.path.join(output_dir, output_filename)
-        
-        # 파일 저장
-        sf.write(output_path, mixed_audio, sr)
-        
-        return output_path
-    except Exception as e:
-        return f"Error processing {target_file} with {noise_file} at {level_name} level: {str(e)}"
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = multiprocessing.cpu_count()
+    return max(1, int(available * 0.8))
+
+def init_worker(noise_cache):
+    """Pool 워커 초기화 함수. 노이즈 캐시를 전역으로 설정하고 JIT 커널을 예열합니다."""
+    global _NOISE_CACHE
+    _NOISE_CACHE = noise_cache
+    # fork가 아닌 시작 방식이나 콜드 캐시에서도 첫 작업 전에 컴파일을 끝내 둠
+    mix_and_normalize(np.zeros(16, dtype=np.float32), np.zeros(16, dtype=np.float32),
+                      np.ones(len(snr_levels), dtype=np.float32))
+
+# 단일 작업 처리 함수 (병렬 처리용)
+# 길이가 비슷한 타겟 묶음에 대해 모든 (노이즈, SNR 레벨) 조합을 처리합니다.
+# 묶음 단위로 음성 RMS를 일괄 계산하고 노이즈 확장 버퍼를 공유합니다.
+# 개별 타겟의 실패는 해당 타겟의 조합만 건너뛰도록 오류를 타겟 단위로 격리합니다.
+def process_batch(batch_files):
+    output_paths = []
+    errors = []
+    write_futures = []
+    # 파일 쓰기는 백그라운드 스레드로 넘겨 다음 합성 연산과 겹치게 함
+    # with 블록이므로 도중에 예외가 나도 스레드가 반드시 정리됨
+    with ThreadPoolExecutor(max_workers=2) as writer:
+        # 음성 파일 로드 후 샘플링 레이트별로 묶음 (노이즈 준비를 공유하기 위함)
+        # 읽기에 실패한 타겟은 자기 오류만 남기고 나머지 묶음 처리를 계속함
+        by_sr = {}
+        for target_file in batch_files:
+            try:
+                speech, sr = load_wav(target_file)
+            except Exception as e:
+                errors.append(f"Error processing {target_file}: {str(e)}")
+                continue
+            by_sr.setdefault(sr, []).append((target_file, speech))
+
+        for sr, items in by_sr.items():
+            try:
+                lengths = np.array([len(speech) for _, speech in items])
+                max_len = int(lengths.max())
+
+                # (K, N) 제로 패딩 행렬로 쌓아 음성 RMS를 한 번의 벡터 연산으로 계산
+                # 패딩 0은 제곱합에 기여하지 않으므로 실제 길이로 나누면 RMS가 보존됨
+                speech_batch = np.zeros((len(items), max_len), dtype=np.float32)
+                for k, (_, speech) in enumerate(items):
+                    speech_batch[k, :len(speech)] = speech
+                speech_rms = np.sqrt(np.einsum('ij,ij->i', speech_batch, speech_batch) / lengths)
+
+                # 클리핑 가능성 판정에 쓰는 음성 피크 (타겟당 한 번)
+                speech_peaks = [absmax(speech) for _, speech in items]
+            except Exception as e:
+                errors.extend(f"Error processing {t}: {str(e)}" for t, _ in items)
+                continue
+
+            for noise_file, (noise, noise_sr) in _NOISE_CACHE.items():
+                # 노이즈 이름 추출 (.wav 제거)
+                noise_id = get_filename_without_extension(noise_file)
+
+                try:
+                    # 샘플링 레이트가 다르면 소음 파일 리샘플링 (워커별로 한 번만)
+                    if sr != noise_sr:
+                        noise = resample_noise(noise_file, noise, noise_sr, sr)
+
+                    # 노이즈 피크도 캐시 (자르기는 피크를 키울 수 없으므로 상한으로 유효)
+                    peak_key = (noise_file, sr)
+                    noise_peak = _NOISE_PEAK_CACHE.get(peak_key)
+                    if noise_peak is None:
+                        noise_peak = absmax(noise)
+                        _NOISE_PEAK_CACHE[peak_key] = noise_peak
+
+                    # 묶음 최대 길이에 맞춰 한 번만 확장하고 타겟별로는 잘라서 공유
+                    noise_full = fit_noise_length(noise, max_len, out=_noise_buffer(max_len))
+                except Exception as e:
+                    # 노이즈 준비 실패는 이 노이즈와의 조합들만 건너뜀
+                    errors.extend(f"Error processing {t} with {noise_file}: {str(e)}" for t, _ in items)
+                    continue
+
+                for k, (target_file, speech) in enumerate(items):
+                    try:
+                        noise_k = noise_full[:len(speech)]
+
+                        # 타겟별 노이즈 RMS로 3개 SNR 레벨의 조정 계수를 벡터로 구함
+                        factors = snr_adjustment_factors(speech_rms[k], calculate_rms(noise_k))
+
+                        # max|speech| + f*max|noise| <= 1이면 어떤 샘플도 클리핑될 수 없으므로
+                        # 피크 탐색/정규화 패스를 통째로 생략
+                        may_clip = speech_peaks[k] + float(factors.max()) * noise_peak > 1.0
+
+                        # 세 레벨 합성과 (필요할 때만) 클리핑 방지 정규화를 한 번에 수행
+                        mixed = mix_and_normalize(speech, noise_k, factors, may_clip,
+                                                  out=_mix_buffer(len(factors), len(speech)))
+
+                        # 출력은 기존과 동일한 16비트 PCM이므로 미리 한 번에 변환 (쓰기 바이트 수 절반)
+                        # 스크래치는 다음 반복에서 재사용되므로 제자리 변환 후 int16 사본만 남김
+                        np.multiply(mixed, 32767.0, out=mixed)
+                        np.clip(mixed, -32768, 32767, out=mixed)
+                        pcm = mixed.astype(np.int16)
+
+                        # 타겟 파일명 추출
+                        target_basename = get_filename_without_extension(target_file)
+
+                        for row, level_name in enumerate(snr_levels):
+                            # 출력 폴더명 설정 ({난이도}_{노이즈명} 형식)
+                            output_dir = f"{level_name}_{noise_id}"
+
+                            # 출력 폴더가 없으면 생성
+                            os.makedirs(output_dir, exist_ok=True)
+
+                            # 출력 파일 이름 (원본 파일명 유지)
+                            output_path = os.path.join(output_dir, f"{target_basename}.wav")
+
+                            # 파일 저장 (비동기 제출, pcm 버퍼는 반복마다 새로 할당되므로 복사 불필요)
+                            write_futures.append(
+                                (writer.submit(write_wav, output_path, pcm[row], sr), output_path, target_file))
+                    except Exception as e:
+                        errors.append(f"Error processing {target_file} with {noise_file}: {str(e)}")
+
+        # 모든 쓰기가 끝날 때까지 대기하고, 실패한 쓰기는 해당 파일의 오류로만 기록
+        for future, output_path, target_file in write_futures:
+            try:
+                future.result()
+                output_paths.append(output_path)
+            except Exception as e:
+                errors.append(f"Error writing {output_path} for {target_file}: {str(e)}")
+
+    return output_paths, errors
 
 def main():
     # 파일 경로 가져오기
@@ -113,29 +353,57 @@ def main():
     noise_files = sorted(glob(os.path.join(noise_dir, '*.wav')))
     
     print(f"총 {len(target_files)}개의 타겟 오디오, {len(noise_files)}개의 노이즈 파일, {len(snr_levels)}개의 SNR 레벨")
-    
-    # 모든 작업 조합 생성
-    tasks = []
-    for i, target_file in enumerate(target_files):
-        for j, noise_file in enumerate(noise_files):
-            for level_name, snr_value in snr_levels.items():
-                task_idx = len(tasks) + 1
-                tasks.append((target_file, noise_file, level_name, snr_value, task_idx))
-    
-    total_combinations = len(tasks)
+
+    # 노이즈 파일을 한 번씩만 디코딩해서 캐시 (조합마다 재디코딩 방지)
+    # 읽기에 실패한 노이즈는 보고만 하고 나머지 노이즈로 계속 진행
+    noise_cache = {}
+    for noise_file in noise_files:
+        try:
+            noise_cache[noise_file] = load_wav(noise_file)
+        except Exception as e:
+            print(f"노이즈 파일을 읽을 수 없어 제외합니다: {noise_file} ({e})")
+
+    # JIT 워밍업은 워커 initializer에서만 수행
+    # (부모에서 parallel=True 커널을 실행한 뒤 fork하면 종료 시 교착이 발생할 수 있음)
+
+    # 긴 파일부터 배분해 풀 말미의 워커 유휴 시간을 줄임 (LPT 휴리스틱)
+    # sf.info는 헤더만 읽으므로 비용이 거의 없음
+    # 헤더를 읽을 수 없는 파일은 0으로 취급해 정렬만 통과시키고,
+    # 실제 오류는 워커의 타겟 단위 처리에서 기록되게 함
+    def frames_or_zero(filepath):
+        try:
+            return sf.info(filepath).frames
+        except Exception:
+            return 0
+
+    target_files.sort(key=frames_or_zero, reverse=True)
+
+    # 길이순 정렬 상태에서 연속 구간을 묶어 길이가 비슷한 타겟끼리 배치 구성
+    batches = [target_files[i:i + BATCH_SIZE] for i in range(0, len(target_files), BATCH_SIZE)]
+
+    total_combinations = len(target_files) * len(noise_files) * len(snr_levels)
     print(f"총 {total_combinations}개의 조합을 처리할 예정입니다.")
-    
-    # 병렬 처리를 위한 CPU 코어 수 설정 (사용 가능한 코어의 80%를 사용)
-    num_processes = max(1, int(multiprocessing.cpu_count() * 0.8))
+
+    # 병렬 처리를 위한 CPU 코어 수 설정 (물리 코어 기준)
+    num_processes = default_worker_count()
     print(f"병렬 처리에 {num_processes}개의 프로세스를 사용합니다.")
-    
+
     # 멀티프로세싱 실행
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        results = list(tqdm(pool.imap(process_combination, tasks), total=total_combinations, desc="오디오 합성 중"))
-    
-    # 성공 및 실패 결과 확인
-    success_count = sum(1 for r in results if not r.startswith("Error"))
-    error_count = sum(1 for r in results if r.startswith("Error"))
+    # 배치 단위 작업이므로 chunksize를 키워 imap 스케줄링 오버헤드를 줄임
+    chunksize = max(1, len(batches) // (num_processes * 4))
+    with multiprocessing.Pool(processes=num_processes, initializer=init_worker, initargs=(noise_cache,)) as pool:
+        # 진행률 표시는 0.5초 간격으로만 갱신 (항목마다 터미널 출력 방지)
+        results = list(tqdm(pool.imap_unordered(process_batch, batches, chunksize=chunksize),
+                            total=len(batches), desc="오디오 합성 중",
+                            mininterval=0.5, miniters=max(1, len(batches) // 500), smoothing=0))
+
+    # 성공 및 실패 결과 확인 (각 배치는 생성된 파일 경로 목록과 오류 목록을 반환)
+    success_count = 0
+    errors = []
+    for paths, batch_errors in results:
+        success_count += len(paths)
+        errors.extend(batch_errors)
+    error_count = len(errors)
     
     print("\n모든 파일 처리 완료!")
     print(f"총 {success_count}개의 합성 오디오 파일이 생성되었습니다.")
@@ -143,7 +411,6 @@ def main():
     if error_count > 0:
         print(f"처리 중 {error_count}개의 오류가 발생했습니다.")
         # 에러 출력 (처음 10개만)
-        errors = [r for r in results if r.startswith("Error")]
         for i, error in enumerate(errors[:10]):
             print(f"  오류 {i+1}: {error}")
         if len(errors) > 10: